@@ -1,12 +1,45 @@
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import subprocess
 import os
+import lzma
 import shutil
+import tarfile
 import tempfile
+import threading
 import getpass
+import functools
+import hashlib
+import mmap
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
+
+# Version literal baked into BtbN master builds, e.g. N-118193-g5f38c82536-20241229
+_EMBEDDED_VERSION_RE = re.compile(rb'N-\d+-g[0-9a-f]+-\d{8}')
+
+# Build date component of a version string
+_VER_DATE_RE = re.compile(r'-(\d{8})(?:$|-)')
+
+class DownloadProgress:
+    """Print download progress at most once per MiB"""
+    
+    def __init__(self, total_size: int, downloaded: int = 0):
+        self.total_size = total_size
+        self.downloaded = downloaded
+        self._last_step = downloaded >> 20
+    
+    def advance(self, count: int):
+        self.downloaded += count
+        step = self.downloaded >> 20
+        if self.total_size > 0 and (step != self._last_step or self.downloaded >= self.total_size):
+            self._last_step = step
+            progress = (self.downloaded / self.total_size) * 100
+            print(f"\rDownload progress: {progress:.1f}%", end='', flush=True)
+
 
 class FFmpegUpdater:
     def __init__(self, install_dir: Optional[str] = None):
@@ -23,20 +56,53 @@ class FFmpegUpdater:
             self.install_dir = Path.home() / 'ffmpeg'
         
         self.ffmpeg_binary = self.install_dir / 'bin' / 'ffmpeg'
+        
+        # ETag/Last-Modified of the archive the current install came from
+        self._etag_path = self.install_dir / '.ffmpeg_etag'
+        
+        # Interrupted downloads are kept here so the next run can resume them
+        self._part_path = self.install_dir.parent / '.ffmpeg_download.part'
+        self._part_etag_path = self.install_dir.parent / '.ffmpeg_download.part.etag'
+        
+        # Background removal of the previous installation's backup
+        self._cleanup_thread: Optional[threading.Thread] = None
+        self._cleanup_error: Optional[OSError] = None
+        
+        # Number of parallel range requests used to download the archive
+        self.download_workers = 8
+        
+        # One pooled session for every request, so connections (and their
+        # TLS handshakes) are reused between the HEAD, checksum and range GETs
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.download_workers,
+            pool_maxsize=self.download_workers,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        )
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        
+        # Archive subdirectories needed at runtime, everything else (docs,
+        # manpages) is skipped during extraction
+        self.extract_subdirs = ('bin', 'presets')
         print(f"Running as user: {self.username}")
         print(f"Installation directory: {self.install_dir}")
         
-    def get_version_date(self, version_str: str) -> Optional[str]:
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def get_version_date(version_str: str) -> Optional[str]:
         """Extract date from version string (e.g., N-118193-g5f38c82536-20241229 -> 20241229)"""
+        match = _VER_DATE_RE.search(version_str)
+        return match.group(1) if match else None
+    
+    def _read_embedded_version(self, binary: Path) -> Optional[str]:
+        """Read the version string baked into an FFmpeg binary without running it"""
         try:
-            parts = version_str.split('-')
-            # Look for a part that looks like a date (8 digits)
-            for part in reversed(parts):
-                if part.isdigit() and len(part) == 8:
-                    return part
-            return None
-        except Exception as e:
-            print(f"Error parsing version date: {e}")
+            with open(binary, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    match = _EMBEDDED_VERSION_RE.search(mm)
+                    return match.group(0).decode('ascii') if match else None
+        except (OSError, ValueError):
             return None
     
     def get_current_version(self) -> Optional[str]:
@@ -44,6 +110,11 @@ class FFmpegUpdater:
         if not self.ffmpeg_binary.exists():
             print(f"FFmpeg not found at {self.ffmpeg_binary}")
             return None
+        
+        version = self._read_embedded_version(self.ffmpeg_binary)
+        if version:
+            print(f"Current FFmpeg version: {version}")
+            return version
             
         try:
             result = subprocess.run(
@@ -74,52 +145,287 @@ class FFmpegUpdater:
             print(f"Error occurred while checking version: {e}")
             return None
     
-    def download_ffmpeg(self, download_dir: Path) -> Optional[Path]:
-        """Download latest FFmpeg to specified directory"""
-        print('Downloading the latest FFmpeg version...')
+    def get_remote_archive(self) -> Optional[Tuple[str, int, Optional[str]]]:
+        """Get URL, size and ETag (or Last-Modified) of the latest release archive
+        
+        The URL is the one the release redirect resolves to, so later requests
+        for the archive skip the redirect. Size is 0 if the server did not
+        report it.
+        """
+        try:
+            head = self._session.head(self.ffmpeg_url, allow_redirects=True, timeout=60)
+            head.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Could not check latest release: {e}")
+            return None
         
+        total_size = int(head.headers.get('content-length', 0))
+        validator = head.headers.get('ETag') or head.headers.get('Last-Modified')
+        return head.url, total_size, validator
+    
+    def get_cached_etag(self) -> Optional[str]:
+        """Get ETag stored by the previous successful run"""
+        try:
+            return self._etag_path.read_text().strip() or None
+        except OSError:
+            return None
+    
+    def save_etag(self, etag: Optional[str]):
+        """Remember the ETag of the archive the current install matches"""
+        if not etag:
+            return
         try:
-            response = requests.get(self.ffmpeg_url, stream=True, timeout=60)
+            self._etag_path.write_text(etag + '\n')
+        except OSError as e:
+            print(f"Could not save ETag: {e}")
+    
+    def get_expected_checksum(self) -> Optional[str]:
+        """Get published SHA-256 of the release archive"""
+        # The release publishes SHA-256 sums of every asset in one file
+        release_url, archive_name = self.ffmpeg_url.rsplit('/', 1)
+        try:
+            response = self._session.get(f"{release_url}/checksums.sha256", timeout=60)
             response.raise_for_status()
-            
+        except requests.RequestException as e:
+            print(f"Could not fetch checksums: {e}")
+            return None
+        
+        # Lines look like "<sha256>  <file name>" (or "<sha256> *<file name>")
+        for line in response.text.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].lstrip('*') == archive_name:
+                return parts[0].lower()
+        
+        print(f"No checksum published for {archive_name}")
+        return None
+    
+    def get_file_checksum(self, path: Path) -> str:
+        """Get SHA-256 of a file"""
+        with open(path, 'rb') as f:
+            # file_digest hashes in C with a reusable buffer (Python 3.11+)
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+            
+            digest = hashlib.sha256()
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+            return digest.hexdigest()
+    
+    def _download_ranges(self, url: str, tar_file: Path, total_size: int) -> bool:
+        """Download url into tar_file using parallel HTTP range requests.
+        
+        Returns False if the server ignores the Range header, in which case
+        the caller should fall back to a single-stream download. If a range
+        fails, tar_file is cut back to the bytes received contiguously from
+        the start so that a later single-stream download can resume it.
+        """
+        part_size = -(-total_size // self.download_workers)
+        ranges = [(lo, min(lo + part_size, total_size) - 1) for lo in range(0, total_size, part_size)]
+        
+        lock = threading.Lock()
+        no_ranges = threading.Event()
+        # Set when any worker fails or the caller is interrupted, so the
+        # remaining workers stop instead of finishing their ranges
+        stop = threading.Event()
+        progress = DownloadProgress(total_size)
+        written = [0] * len(ranges)
+        
+        def fetch_range(index: int) -> bool:
+            lo, hi = ranges[index]
+            headers = {'Range': f'bytes={lo}-{hi}'}
+            try:
+                with self._session.get(url, headers=headers, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        no_ranges.set()
+                        return False
+                    
+                    offset = lo
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if no_ranges.is_set() or stop.is_set():
+                            return False
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        written[index] = offset - lo
+                        with lock:
+                            progress.advance(len(chunk))
+                    
+                    if offset != hi + 1:
+                        raise requests.RequestException(f"Incomplete range {lo}-{hi}: got {offset - lo} bytes")
+                return True
+            except BaseException:
+                stop.set()
+                raise
+        
+        fd = os.open(tar_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # Reserve the whole file up front so the workers can write at their offsets
+            try:
+                os.posix_fallocate(fd, 0, total_size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, total_size)
+            
+            try:
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    try:
+                        results = list(executor.map(fetch_range, range(len(ranges))))
+                    except BaseException:
+                        # Signal the workers before the executor waits for them
+                        stop.set()
+                        raise
+            except BaseException:
+                # Keep only the contiguous prefix, the rest of the file has holes
+                complete = 0
+                for (lo, hi), count in zip(ranges, written):
+                    complete += count
+                    if count != hi - lo + 1:
+                        break
+                os.ftruncate(fd, complete)
+                raise
+        finally:
+            os.close(fd)
+        
+        return all(results)
+    
+    def _download_stream(self, url: str, tar_file: Path, resume_from: int = 0, validator: Optional[str] = None):
+        """Download url into tar_file over a single connection.
+        
+        If resume_from is set, only the bytes after it are requested and
+        appended to tar_file. validator should be the ETag or Last-Modified
+        value of the archive tar_file was started from; it is sent as
+        If-Range so the server returns the whole archive if it changed.
+        """
+        headers = {}
+        if resume_from:
+            headers['Range'] = f'bytes={resume_from}-'
+            if validator:
+                headers['If-Range'] = validator
+        
+        response = self._session.get(url, headers=headers, stream=True, timeout=60)
+        response.raise_for_status()
+        
+        if resume_from and response.status_code == 206:
+            print(f"Resuming download at {resume_from} bytes")
+            mode = 'ab'
+            downloaded = resume_from
+        else:
+            mode = 'wb'
+            downloaded = 0
+        
+        # Get total size for progress tracking
+        total_size = int(response.headers.get('content-length', 0))
+        if total_size > 0:
+            total_size += downloaded
+        
+        # Read 1 MiB blocks to keep the Python-level loop short; iter_content
+        # also turns dropped connections into requests exceptions
+        progress = DownloadProgress(total_size, downloaded)
+        with open(tar_file, mode) as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+                progress.advance(len(chunk))
+    
+    def download_ffmpeg(self, download_dir: Path, url: str, total_size: int, validator: Optional[str],
+                        expected_checksum: Optional[str]) -> Optional[Path]:
+        """Download latest FFmpeg to specified directory
+        
+        url, total_size and validator are as returned by get_remote_archive;
+        a known size lets the download be split into parallel range requests.
+        expected_checksum should be fetched together with them, so that both
+        describe the same release; verification is skipped if it is None.
+        """
+        print('Downloading the latest FFmpeg version...')
+        
+        try:
             tar_file = download_dir / "ffmpeg-master-latest-linux64-gpl.tar.xz"
             
-            # Get total size for progress tracking
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+            part_file = self._part_path
+            part_file.parent.mkdir(parents=True, exist_ok=True)
+            resume_from = part_file.stat().st_size if part_file.exists() else 0
             
-            with open(tar_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            progress = (downloaded / total_size) * 100
-                            print(f"\rDownload progress: {progress:.1f}%", end='', flush=True)
+            # Only resume a partial file that came from this same archive
+            try:
+                part_validator = self._part_etag_path.read_text().strip() or None
+            except OSError:
+                part_validator = None
             
+            if 0 < resume_from < total_size and validator and part_validator == validator:
+                self._download_stream(url, part_file, resume_from, part_validator)
+            else:
+                # Starting over, record which archive the new .part belongs to
+                if validator:
+                    self._part_etag_path.write_text(validator + '\n')
+                else:
+                    self._part_etag_path.unlink(missing_ok=True)
+                
+                if total_size <= 0 or not self._download_ranges(url, part_file, total_size):
+                    if total_size > 0:
+                        print("\nServer does not support range requests, downloading in a single stream")
+                    self._download_stream(url, part_file)
+            
+            os.replace(part_file, tar_file)
+            self._part_etag_path.unlink(missing_ok=True)
             print(f"\nDownloaded FFmpeg archive to {tar_file}")
             
             # Verify file is not corrupted (basic check)
             if tar_file.stat().st_size < 1024 * 1024:  # Less than 1MB is suspicious
                 print("Warning: Downloaded file seems too small")
                 return None
+            
+            if expected_checksum:
+                actual = self.get_file_checksum(tar_file)
+                if actual != expected_checksum:
+                    print(f"Checksum mismatch: expected {expected_checksum}, got {actual}")
+                    return None
+                print("Checksum verified")
+            else:
+                print("Warning: Skipping checksum verification")
                 
             return tar_file
             
-        except requests.RequestException as e:
+        except (requests.RequestException, OSError) as e:
             print(f"\nFailed to download FFmpeg: {e}")
             return None
     
+    def _extract_members(self, tf: tarfile.TarFile, extract_dir: Path):
+        """Extract top-level files and extract_subdirs from a streamed archive"""
+        # Use the 'data' safety filter where available (Python 3.12, backported to 3.8.17+)
+        extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        
+        for member in tf:
+            # Members look like ffmpeg-master-latest-linux64-gpl/bin/ffmpeg
+            parts = member.name.split('/')
+            if len(parts) < 2 or not parts[1]:
+                continue
+            if parts[1] in self.extract_subdirs or (len(parts) == 2 and member.isfile()):
+                tf.extract(member, extract_dir, **extract_kwargs)
+    
     def extract_ffmpeg(self, tar_file: Path, extract_dir: Path) -> Optional[Path]:
         """Extract FFmpeg tar.xz file"""
         try:
             print(f"Extracting {tar_file}...")
-            result = subprocess.run(
-                ['tar', '-xJf', str(tar_file), '-C', str(extract_dir)],
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            
+            # Let xz decode blocks on all cores when it is available and
+            # unpack its output in-process; otherwise fall back to lzma
+            if shutil.which('xz'):
+                with subprocess.Popen(
+                    ['xz', '-T0', '-dc', str(tar_file)],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    bufsize=1024 * 1024
+                ) as proc:
+                    with tarfile.open(fileobj=proc.stdout, mode='r|') as tf:
+                        self._extract_members(tf, extract_dir)
+                    # tarfile stops at the end-of-archive marker; drain the
+                    # padding after it so xz can exit instead of blocking on a full pipe
+                    while proc.stdout.read(1024 * 1024):
+                        pass
+                    stderr = proc.stderr.read()
+                if proc.returncode != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr.decode(errors='replace'))
+            else:
+                with tarfile.open(tar_file, mode='r|xz') as tf:
+                    self._extract_members(tf, extract_dir)
             
             # Find the extracted directory
             extracted_dirs = [d for d in extract_dir.iterdir() if d.is_dir() and 'ffmpeg' in d.name.lower()]
@@ -137,6 +443,9 @@ class FFmpegUpdater:
             print(f"Error extracting FFmpeg: {e}")
             print(f"stderr: {e.stderr}")
             return None
+        except (tarfile.TarError, lzma.LZMAError) as e:
+            print(f"Error extracting FFmpeg: {e}")
+            return None
         except Exception as e:
             print(f"Unexpected error during extraction: {e}")
             return None
@@ -147,10 +456,16 @@ class FFmpegUpdater:
         if not ffmpeg_bin.exists():
             print(f"FFmpeg binary not found in {ffmpeg_bin}")
             return None
+        
+        version = self._read_embedded_version(ffmpeg_bin)
+        if version:
+            print(f"Downloaded FFmpeg version: {version}")
+            return version
             
         try:
-            # Make binary executable
-            ffmpeg_bin.chmod(0o755)
+            # The archive keeps mode bits, only fix them up if they were lost
+            if not os.access(ffmpeg_bin, os.X_OK):
+                ffmpeg_bin.chmod(0o755)
             
             result = subprocess.run(
                 [str(ffmpeg_bin), '-version'],
@@ -202,32 +517,32 @@ class FFmpegUpdater:
             
             # Backup existing installation if it exists
             backup_dir = None
+            self.wait_for_cleanup()
             if self.install_dir.exists():
                 backup_dir = self.install_dir.with_name(self.install_dir.name + '.backup')
                 if backup_dir.exists():
                     shutil.rmtree(backup_dir)
                 print(f"Backing up existing installation to {backup_dir}")
-                shutil.move(str(self.install_dir), str(backup_dir))
+                os.replace(self.install_dir, backup_dir)
             
             # Create parent directory if needed
             self.install_dir.parent.mkdir(parents=True, exist_ok=True)
             
-            # Move new installation
-            shutil.move(str(source_dir), str(self.install_dir))
-            
-            # Make all binaries executable
-            bin_dir = self.install_dir / 'bin'
-            if bin_dir.exists():
-                for binary in bin_dir.glob('*'):
-                    if binary.is_file():
-                        binary.chmod(0o755)
+            # Move new installation (a single rename, source_dir is on the same filesystem)
+            os.replace(source_dir, self.install_dir)
             
             print(f"FFmpeg successfully installed to {self.install_dir}")
             
-            # Remove backup if installation successful
+            # Remove backup if installation successful, in the background
+            # so a large tree does not delay the rest of the update
             if backup_dir and backup_dir.exists():
-                shutil.rmtree(backup_dir)
-                print("Removed backup")
+                self._cleanup_error = None
+                self._cleanup_thread = threading.Thread(
+                    target=self._remove_backup,
+                    args=(backup_dir,),
+                    daemon=False
+                )
+                self._cleanup_thread.start()
                 
             return True
             
@@ -238,11 +553,30 @@ class FFmpegUpdater:
             if backup_dir and backup_dir.exists():
                 if self.install_dir.exists():
                     shutil.rmtree(self.install_dir)
-                shutil.move(str(backup_dir), str(self.install_dir))
+                os.replace(backup_dir, self.install_dir)
                 print("Restored previous installation")
             
             return False
     
+    def _remove_backup(self, backup_dir: Path):
+        """Delete backup_dir, recording any error for wait_for_cleanup"""
+        try:
+            shutil.rmtree(backup_dir)
+        except OSError as e:
+            self._cleanup_error = e
+    
+    def wait_for_cleanup(self):
+        """Wait for a background backup removal to finish and report its result"""
+        if not self._cleanup_thread:
+            return
+        
+        self._cleanup_thread.join()
+        self._cleanup_thread = None
+        if self._cleanup_error:
+            print(f"Warning: Could not remove backup: {self._cleanup_error}")
+        else:
+            print("Removed backup")
+    
     def add_to_path_instructions(self):
         """Provide instructions for adding FFmpeg to PATH"""
         bin_path = self.install_dir / 'bin'
@@ -284,11 +618,28 @@ class FFmpegUpdater:
         
         current_version = self.get_current_version()
         
-        with tempfile.TemporaryDirectory() as temp_dir:
+        remote_archive = self.get_remote_archive()
+        if not remote_archive:
+            return False
+        remote_url, remote_size, remote_etag = remote_archive
+        
+        # Skip the download entirely if the release archive has not changed
+        if not force and current_version and remote_etag and remote_etag == self.get_cached_etag():
+            print(f"\nRelease archive unchanged, current version ({current_version}) is already up-to-date!")
+            return True
+        
+        # Fetch the checksum now rather than after the download, while the
+        # floating release tag still points at the archive found by the HEAD
+        expected_checksum = self.get_expected_checksum()
+        
+        # Work next to install_dir so the new install and the downloaded
+        # archive can be moved into place with a rename instead of a copy
+        self.install_dir.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix='.ffmpeg-update-', dir=self.install_dir.parent) as temp_dir:
             temp_path = Path(temp_dir)
             
             # Download latest version
-            tar_file = self.download_ffmpeg(temp_path)
+            tar_file = self.download_ffmpeg(temp_path, remote_url, remote_size, remote_etag, expected_checksum)
             if not tar_file:
                 return False
             
@@ -307,6 +658,7 @@ class FFmpegUpdater:
             if not force and current_version:
                 if not self.compare_versions(current_version, new_version):
                     print(f"\nCurrent version ({current_version}) is already up-to-date!")
+                    self.save_etag(remote_etag)
                     return True
             
             # Install new version
@@ -315,6 +667,7 @@ class FFmpegUpdater:
             success = self.install_ffmpeg(extracted_dir)
             
             if success:
+                self.save_etag(remote_etag)
                 final_version = self.get_current_version()
                 print("\n" + "=" * 60)
                 print(f"✓ FFmpeg successfully {'installed' if not current_version else 'updated'}!")
@@ -344,6 +697,7 @@ if __name__ == "__main__":
     try:
         updater = FFmpegUpdater(install_dir=args.install_dir)
         success = updater.update(force=args.force)
+        updater.wait_for_cleanup()
         exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\n\nUpdate cancelled by user")